@@ -0,0 +1,66 @@
+"""
+Run every existing service as a separate, parametrized pytest case (see
+`test_services.py` for how each service is tested). Services are independent
+of one another, so the cases can be distributed across worker processes via
+pytest-xdist:
+
+    pytest -n auto pisa_tests/test_all_services.py
+"""
+
+from __future__ import absolute_import
+
+import pytest
+
+from pisa_tests.test_services import (
+    STAGES_PATH,
+    check_service,
+    find_services,
+    get_module_pypaths,
+    get_stage_dot_service_from_module_pypath,
+)
+
+
+__all__ = ["SERVICES", "test_service"]
+
+__license__ = """Copyright (c) 2014-2024, The IceCube Collaboration
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+
+SERVICES = [
+    (rel_file_path, service_names)
+    for rel_file_path, service_names in find_services(STAGES_PATH).items()
+    if service_names
+]
+"""(relative file path, service names) of each module defining a service,
+collected once at import (i.e., pytest collection) time"""
+
+
+@pytest.mark.parametrize(
+    "rel_file_path, service_names",
+    SERVICES,
+    ids=[
+        get_stage_dot_service_from_module_pypath(get_module_pypaths(rel)[1])
+        for rel, _ in SERVICES
+    ],
+)
+def test_service(rel_file_path, service_names):
+    """Test a single service"""
+    stage_dot_service, status, err = check_service(
+        rel_file_path=rel_file_path, service_names=service_names
+    )
+    if status == "skip":
+        pytest.skip(f"{stage_dot_service} requested to be ignored")
+    if status == "ignore":
+        pytest.skip(f"{stage_dot_service} requires a missing optional module")
+    assert status == "pass", f"{stage_dot_service} failed ({status}): {err}"
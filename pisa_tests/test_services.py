@@ -12,15 +12,25 @@ module.
 
 from __future__ import absolute_import
 
-from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
-from importlib import import_module
-from os import walk
-from os.path import isfile, join, relpath
+from argparse import (
+    ArgumentDefaultsHelpFormatter, ArgumentParser, ArgumentTypeError
+)
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from importlib import import_module, invalidate_caches
+import json
+import mmap
+import os
+from os import scandir, sep
+from os.path import basename, dirname, isfile, join, relpath, split, splitext
+import re
 import sys
+import tempfile
 
 import numpy as np
 
-from pisa import FTYPE, ITYPE, ureg
+from pisa import CACHE_DIR, FTYPE, ITYPE, ureg
 from pisa.core.binning import OneDimBinning, MultiDimBinning
 from pisa.core.container import Container, ContainerSet
 from pisa.core.stage import Stage
@@ -32,14 +42,25 @@ from pisa_tests.run_unit_tests import PISA_PATH, OPTIONAL_MODULES
 
 __all__ = [
     "STAGES_PATH",
+    "SERVICES_CACHE_PATH",
+    "SERVICES_CACHE_VERSION",
     "INIT_TEST_NAME",
     "TEST_BINNING",
     "SKIP_SERVICES",
     "AUX_DATA_KEYS",
+    "INIT_TEST_KWARGS",
+    "STANDALONE_KWARGS",
+    "STAGE_CLASS_RE",
     "test_services",
+    "test_find_services_cache",
+    "test_scan_source_file_mmap",
+    "check_service",
+    "iter_service_tests",
     "find_services",
+    "iter_services",
     "find_services_in_file",
     "get_stage_dot_service_from_module_pypath",
+    "get_module_pypaths",
     "add_test_inputs",
     "is_allowed_import_error",
     "set_service_attributes"
@@ -63,6 +84,10 @@ __license__ = """Copyright (c) 2014-2024, The IceCube Collaboration
 
 
 STAGES_PATH = join(PISA_PATH, "stages")
+STAGES_PYPATH_PREFIX = "pisa.stages."
+SERVICES_CACHE_PATH = join(CACHE_DIR, "test_services_cache.json")
+"""Cache of the services found in each file by `find_services`, which is
+invalidated per file based on modification time and size"""
 INIT_TEST_NAME = "init_test"
 """Assumed name of custom function in each module which returns an
 example instance of the service in question"""
@@ -72,60 +97,182 @@ TEST_BINNING = MultiDimBinning([
     OneDimBinning(name='pid', is_lin=True, num_bins=3, domain=[0.1, 1]),
 ])
 AUX_DATA_KEYS = ['nubar', 'flav']
+INIT_TEST_KWARGS = {'prior': None, 'range': None, 'is_fixed': True}
+"""Keyword arguments passed to a module's `INIT_TEST_NAME` function"""
+STANDALONE_KWARGS = {'in_standalone_mode': True}
+"""Keyword arguments for instantiating a service without `INIT_TEST_NAME`"""
+
+_TEST_INPUT = np.linspace(0.1, 1, 10, dtype=FTYPE)
+"""Read-only template of the generic test input array for each container key"""
+_TEST_INPUT.setflags(write=False)
 
-SKIP_SERVICES = (
+SKIP_SERVICES = frozenset((
     'osc.external', 'flux.airs'
+))
+"""If no other way, add hopeless cases in <stage>.<service> format (frozenset
+for constant-time membership tests)"""
+
+STAGE_CLASS_RE = re.compile(
+    rb"^[ \t]*class[ \t]+(\w+)[ \t]*\([^)]*\bStage\b[^)]*\)", re.MULTILINE
 )
-"""If no other way, add hopeless cases in <stage>.<service> format"""
+"""Matches the definition of a class deriving from `Stage` in Python source
+(bytes), capturing the class (i.e., service) name"""
+
+SERVICES_CACHE_VERSION = "2:" + STAGE_CLASS_RE.pattern.decode()
+"""Identifies the format of `SERVICES_CACHE_PATH` and the scanner which
+produced it; bump the leading number whenever either changes in a way not
+captured by `STAGE_CLASS_RE`"""
+
+_MMAP_MIN_SIZE = 1 << 20
+"""Minimum size (bytes) of a source file to be scanned via `mmap` (1 MiB)"""
 
 PFX = "[S] "
 """Prefix each line output by this script to clearly delineate output from this
 script vs. output from test functions being run"""
 
 
-def find_services(path):
-    """Modelled after `run_unit_tests.find_unit_tests`"""
+def find_services(path, cache_path=SERVICES_CACHE_PATH):
+    """Modelled after `run_unit_tests.find_unit_tests`; see `iter_services`"""
+    return dict(iter_services(path, cache_path=cache_path))
+
+
+def iter_services(path, cache_path=SERVICES_CACHE_PATH):
+    """Yield `(rel_file_path, service_names)` for the file `path` or each
+    ".py" file found (recursively) below the directory `path`, as soon as
+    that file has been scanned. Sources are read concurrently, and services
+    found in files below a directory are cached on disk at `cache_path`,
+    such that only files whose modification time or size changed since the
+    last invocation need to be read."""
     path = expand(path, absolute=True, resolve_symlinks=True)
 
-    services = {}
     if isfile(path):
-        filerelpath = relpath(path, start=PISA_PATH)
-        services[filerelpath] = find_services_in_file(path)
-        return services
-
-    for dirpath, dirs, files in walk(path, followlinks=True):
-        files.sort(key=nsort_key_func)
-        dirs.sort(key=nsort_key_func)
+        # `path` is already resolved, so skip `find_services_in_file`
+        yield relpath(path, start=PISA_PATH), _scan_source_file(path)
+        return
+
+    cached = _load_services_cache(cache_path)
+    # Entries below `path` are rebuilt from the walk (dropping those of
+    # deleted files), while those of files elsewhere are kept as they are
+    cache = {
+        filepath: entry
+        for filepath, entry in cached.items()
+        if not filepath.startswith(path + sep)
+    }
+    entries = []
+    for entry in _iter_py_files(path):
+        stat = entry.stat()
+        entries.append((entry.path, [stat.st_mtime_ns, stat.st_size]))
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        # File reads release the GIL, so a thread pool overlaps the otherwise
+        # serial `open` + `read` calls
+        scans = {
+            filepath: executor.submit(_scan_source_file, filepath)
+            for filepath, stamp in entries
+            if cached.get(filepath, [None, None])[:2] != stamp
+        }
+        for filepath, stamp in entries:
+            if filepath in scans:
+                service_names = scans[filepath].result()
+            else:
+                service_names = cached[filepath][2]
+            cache[filepath] = stamp + [service_names]
+            yield relpath(filepath, start=PISA_PATH), service_names
+
+    if cache != cached:
+        _save_services_cache(cache, cache_path)
+
+
+def _load_services_cache(cache_path):
+    """Load {filepath: [mtime_ns, size, service names]} from `cache_path`, or
+    return an empty dict if it does not exist, cannot be read, was written
+    for a different `SERVICES_CACHE_VERSION` or has unexpected contents"""
+    try:
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if (
+        not isinstance(cache, dict)
+        or cache.get("version") != SERVICES_CACHE_VERSION
+        or not isinstance(cache.get("files"), dict)
+    ):
+        return {}
+    return {
+        filepath: entry
+        for filepath, entry in cache["files"].items()
+        if isinstance(entry, list)
+        and len(entry) == 3
+        and isinstance(entry[2], list)
+        and all(isinstance(name, str) for name in entry[2])
+    }
+
+
+def _save_services_cache(cache, cache_path):
+    """Write `cache` to `cache_path`; failure to do so is not fatal"""
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(dirname(cache_path), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump({"version": SERVICES_CACHE_VERSION, "files": cache}, f)
+        # atomic, so concurrent test runs never see a partially written file
+        os.replace(tmp_path, cache_path)
+    except OSError as err:
+        logging.debug(
+            "%sCould not write services cache %s: %s", PFX, cache_path, err
+        )
 
-        for filename in files:
-            if not filename.endswith(".py"):
-                continue
-            filepath = join(dirpath, filename)
-            filerelpath = relpath(filepath, start=PISA_PATH)
-            services[filerelpath] = find_services_in_file(filepath)
 
-    return services
+def _iter_py_files(path):
+    """Recursively yield `os.DirEntry`s of the ".py" files below directory
+    `path`, in the same (natural-sort, files before subdirectories) order as
+    `os.walk`. `os.scandir` entries carry their file type, so no extra `stat`
+    is needed per file."""
+    with scandir(path) as it:
+        entries = sorted(it, key=lambda entry: nsort_key_func(entry.name))
+    subdirs = []
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=True):
+            subdirs.append(entry.path)
+        elif entry.is_file(follow_symlinks=True) and entry.name.endswith(".py"):
+            yield entry
+    for subdir in subdirs:
+        yield from _iter_py_files(subdir)
 
 
 def find_services_in_file(filepath):
     """Modelled after `run_unit_tests.find_unit_tests_in_file`"""
     filepath = expand(filepath, absolute=True, resolve_symlinks=True)
-    assert isfile(filepath), str(filepath)
-    services = []
-    with open(filepath, "r") as f:
-        for line in f.readlines():
-            tokens = line.split()
-            if tokens and tokens[0] == "class" and "(Stage)" in tokens[1]:
-                service_name = tokens[1].split("(")[0].strip()
-                services.append(service_name)
-    return services
+    return _scan_source_file(filepath)
+
+
+def _scan_source_file(filepath):
+    """Names of the `Stage` subclasses defined in the Python source file
+    `filepath`. Files of at least `_MMAP_MIN_SIZE` bytes are scanned via a
+    read-only memory map rather than copied into a bytes object."""
+    with open(filepath, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _MMAP_MIN_SIZE:
+            return _scan_source_bytes(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _scan_source_bytes(mm)
+
+
+def _scan_source_bytes(data):
+    """Names of the `Stage` subclasses defined in Python source `data` (bytes
+    or any other bytes-like object, e.g. `mmap.mmap`)"""
+    # Plain substring search is much cheaper than the regex and rejects the
+    # majority of files (helpers, `__init__.py`, ...) which define no service.
+    # (Use `find`, since `in` only tests for a single byte on `mmap.mmap`.)
+    if data.find(b"Stage") < 0:
+        return []
+    return [m.group(1).decode() for m in STAGE_CLASS_RE.finditer(data)]
 
 
 def get_stage_dot_service_from_module_pypath(module_pypath):
     """Assumes `module_pypath` starts with pisa.stages and we
     have one directory per stage, which contains all services
     implementing that stage."""
-    return module_pypath[12:]
+    return module_pypath[len(STAGES_PYPATH_PREFIX):]
 
 
 def add_test_inputs(service, empty=False):
@@ -140,6 +287,14 @@ def add_test_inputs(service, empty=False):
         keys = set(service.expected_container_keys +
                    ['reco_energy', 'reco_coszen', 'pid', 'weights']
                   )
+        # One contiguous block per container with a row for (at most) each
+        # key instead of one array per generic key. (Not a single broadcast
+        # view: services may modify their inputs in place, so rows must not
+        # share memory.)
+        generic_rows = zip(
+            np.tile(_TEST_INPUT, (len(keys), 1)),
+            np.tile(_TEST_INPUT, (len(keys), 1)),
+        )
         for k in keys:
             if k in AUX_DATA_KEYS:
                 container1.set_aux_data(k, ITYPE(1))
@@ -151,11 +306,12 @@ def add_test_inputs(service, empty=False):
                 container1[k] = np.ones(10, dtype=ITYPE)
                 container2[k] = np.zeros(10, dtype=ITYPE)
             else:
-                container1[k] = np.linspace(0.1, 1, 10, dtype=FTYPE)
-                container2[k] = np.linspace(0.1, 1, 10, dtype=FTYPE)
+                row1, row2 = next(generic_rows)
+                container1[k] = row1
+                container2[k] = row2
         service.data = ContainerSet('data', [container1, container2])
     else:
-        logging.debug(PFX + "Creating empty test inputs...")
+        logging.debug("%sCreating empty test inputs...", PFX)
         service.data = ContainerSet('data')
 
 
@@ -184,209 +340,316 @@ def is_allowed_import_error(err, module_pypath, allow_missing=OPTIONAL_MODULES):
     ):
         err_name = err.name
         logging.warning(
-            PFX + f"module {err_name} failed to import while importing "
-            f"{module_pypath}, but ok to ignore"
+            "%smodule %s failed to import while importing %s, but ok to ignore",
+            PFX, err_name, module_pypath
         )
         return True
     return False
 
 
-def test_services(
-    path=STAGES_PATH,
+def get_module_pypaths(rel_file_path):
+    """Derive the Python paths of the module defined at `rel_file_path`
+    (relative to `PISA_PATH`) and of its parent package"""
+    parent_relpath, module_name = split(splitext(rel_file_path)[0])
+    if parent_relpath:
+        parent_pypath = f"pisa.{parent_relpath.replace(sep, '.')}"
+    else:
+        parent_pypath = "pisa"
+    module_pypath = f"{parent_pypath}.{module_name.replace('.', '_')}"
+    return parent_pypath, module_pypath
+
+
+def check_service(
+    rel_file_path,
+    service_names,
     init_test_name=INIT_TEST_NAME,
     skip_services=SKIP_SERVICES,
     allow_missing=OPTIONAL_MODULES,
     verbosity=Levels.WARN,
 ):
-    """Modelled after `run_unit_tests.run_unit_tests`"""
+    """Import, instantiate, set up and run the single service defined in the
+    module at `rel_file_path` (relative to `PISA_PATH`).
+
+    Returns
+    -------
+    stage_dot_service : str
+    status : str
+        One of "skip" (requested to be skipped), "ignore" (failed due to an
+        allowed missing module), "import_fail", "fail" or "pass"
+    err : Exception or None
+        The exception that caused the failure, if any
+
+    """
     if allow_missing is None:
         allow_missing = []
     elif isinstance(allow_missing, str):
         allow_missing = [allow_missing]
 
-    services = find_services(path=path)
+    parent_pypath, module_pypath = get_module_pypaths(rel_file_path)
 
-    ntries = 0
-    nsuccesses = 0
-    stage_dot_services_failed_ignored = []
-    stage_dot_services_failed = []
-    set_verbosity(verbosity)
+    if not len(service_names) == 1:
+        raise ValueError(
+            '%d > 1 services detected in file %s!'
+            % (len(service_names), module_pypath)
+        )
 
-    for rel_file_path, service_names in services.items():
-        if not service_names:
-            continue
+    service_name = service_names[0]
+    stage_dot_service = get_stage_dot_service_from_module_pypath(module_pypath)
 
-        pypath = ["pisa"] + rel_file_path[:-3].split("/")
-        parent_pypath = ".".join(pypath[:-1])
-        module_name = pypath[-1].replace(".", "_")
-        module_pypath = f"{parent_pypath}.{module_name}"
+    # check whether we should skip testing this service for some reason
+    if stage_dot_service in skip_services:
+        logging.warning(
+            "%s%s requested to be ignored in service test.",
+            PFX, stage_dot_service
+        )
+        return stage_dot_service, "skip", None
 
-        if not len(service_names) == 1:
-            raise ValueError(
-                '%d > 1 services detected in file %s!'
-                % (len(service_names), module_pypath)
-            )
+    logging.info("%sStarting test for service %s...", PFX, stage_dot_service)
 
-        service_name = service_names[0]
-        stage_dot_service = get_stage_dot_service_from_module_pypath(module_pypath)
+    # if service module import successful, try to initialise the service
+    try:
+        module = (
+            sys.modules.get(module_pypath)
+            or import_module(module_pypath, package=parent_pypath)
+        )
+    except Exception as err:
+        if is_allowed_import_error(err, module_pypath, allow_missing):
+            return stage_dot_service, "ignore", err
 
-        # check whether we should skip testing this service for some reason
-        if stage_dot_service in skip_services:
-            logging.warning(
-                PFX + f"{stage_dot_service} requested to be ignored in"
-                " service test."
-            )
-            continue
+        set_verbosity(verbosity)
+        msg = PFX + f"<< FAILURE IMPORTING : {module_pypath} >>"
+        logging.error("=" * len(msg))
+        logging.error(msg)
+        logging.error("=" * len(msg))
 
-        logging.info(PFX + f"Starting test for service {stage_dot_service}...")
-        ntries += 1
+        set_verbosity(Levels.TRACE)
+        logging.exception(err)
 
-        # if service module import successful, try to initialise the service
+        set_verbosity(verbosity)
+        return stage_dot_service, "import_fail", err
+
+    init_test = getattr(module, init_test_name, None)
+    if init_test is None:
         try:
-            module = import_module(module_pypath, package=parent_pypath)
+            # Without a dedicated `init_test` function, we just try to
+            # instantiate the service with std. Stage kwargs
+            service = getattr(module, service_name)(**STANDALONE_KWARGS)
         except Exception as err:
-            if is_allowed_import_error(err, module_pypath, allow_missing):
-                stage_dot_services_failed_ignored.append(stage_dot_service)
-                continue
-
-            stage_dot_services_failed.append(stage_dot_service)
-
-            set_verbosity(verbosity)
-            msg = PFX + f"<< FAILURE IMPORTING : {module_pypath} >>"
-            logging.error("=" * len(msg))
-            logging.error(msg)
-            logging.error("=" * len(msg))
-
-            set_verbosity(Levels.TRACE)
-            logging.exception(err)
-
-            set_verbosity(verbosity)
-            continue
-
-        if not hasattr(module, init_test_name):
-            try:
-                # Without a dedicated `init_test` function, we just try to
-                # instantiate the service with std. Stage kwargs
-                service = getattr(module, service_name)(in_standalone_mode=True)
-            except Exception as err:
-                logging.error(
-                    PFX + f"{stage_dot_service} has no {init_test_name} function "
-                     "and could not be instantiated with standard kwargs only.\n"
-                     "msg: %s" % err
-                )
-                stage_dot_services_failed.append(stage_dot_service)
-                continue
-        else:
-            try:
-                # Exploit presence of init_test (TODO: switch order with above?)
-                param_kwargs = {'prior': None, 'range': None, 'is_fixed': True}
-                service = getattr(module, init_test_name)(**param_kwargs)
-            except Exception as err:
-                logging.error(
-                    PFX + f"{stage_dot_service} has an {init_test_name} function "
-                    "which failed to instantiate the service with msg:\n %s." % err
-                )
-                stage_dot_services_failed.append(stage_dot_service)
-                continue
-
-        if not isinstance(service, Stage):
-            # Could be that init test function exists and runs but doesn't
-            # actually return anything useful
-            service_type = type(service)
             logging.error(
-                PFX + f"Did not get an initialised `Stage` instance for "
-                f"{stage_dot_service} but {service_type}!"
+                "%s%s has no %s function and could not be instantiated with"
+                " standard kwargs only.\nmsg: %s",
+                PFX, stage_dot_service, init_test_name, err
             )
-            stage_dot_services_failed.append(stage_dot_service)
-            continue
-
-        if service.data is None:
-            # For data services, setup usually adds to `data` attribute
-            # (`Pipeline.setup()` assigns empty `ContainerSet`)
-            # TODO: Can/should init ever already result in populated `data` attribute?
-            try:
-                add_test_inputs(
-                    service=service,
-                    empty=stage_dot_service.split('.')[0] == 'data'
-                )
-            except Exception as err:
-                logging.error(
-                    PFX + f"Failed to assign test inputs for "
-                    f"{stage_dot_service} with msg:\n {err}"
-                )
-                stage_dot_services_failed.append(stage_dot_service)
-                continue
-
-        #if service.data is not None: # we should never be in this state here
-        if service.calc_mode is None:
-            logging.debug(PFX + "Setting calc_mode ...")
-            try:
-                service.calc_mode = 'events'
-            except ValueError:
-                service.calc_mode = TEST_BINNING
-            except ImportError as err:
-                if is_allowed_import_error(err, stage_dot_service, allow_missing):
-                    stage_dot_services_failed_ignored.append(stage_dot_service)
-                    continue
-            except Exception as err:
-                logging.error(
-                    PFX + "Failed to set `calc_mode` for "
-                    f"{stage_dot_service} with msg:\n {err}"
-                )
-                stage_dot_services_failed.append(stage_dot_service)
-                continue
-
-        if service.apply_mode is None:
-            logging.debug(PFX + "Setting apply_mode ...")
-            try:
-                service.apply_mode = 'events'
-            except ValueError:
-                service.apply_mode = TEST_BINNING
-            except ImportError as err:
-                if is_allowed_import_error(err, stage_dot_service, allow_missing):
-                    stage_dot_services_failed_ignored.append(stage_dot_service)
-                    continue
-            except Exception as err:
-                logging.error(
-                    PFX + "Failed to set `apply_mode` for "
-                    f"{stage_dot_service} with msg:\n {err}"
-                )
-                stage_dot_services_failed.append(stage_dot_service)
-                continue
+            return stage_dot_service, "fail", err
+    else:
+        try:
+            # Exploit presence of init_test (TODO: switch order with above?)
+            service = init_test(**INIT_TEST_KWARGS)
+        except Exception as err:
+            logging.error(
+                "%s%s has an %s function which failed to instantiate the"
+                " service with msg:\n %s.",
+                PFX, stage_dot_service, init_test_name, err
+            )
+            return stage_dot_service, "fail", err
+
+    if not isinstance(service, Stage):
+        # Could be that init test function exists and runs but doesn't
+        # actually return anything useful
+        service_type = type(service)
+        logging.error(
+            "%sDid not get an initialised `Stage` instance for %s but %s!",
+            PFX, stage_dot_service, service_type
+        )
+        return stage_dot_service, "fail", None
 
+    if service.data is None:
+        # For data services, setup usually adds to `data` attribute
+        # (`Pipeline.setup()` assigns empty `ContainerSet`)
+        # TODO: Can/should init ever already result in populated `data` attribute?
         try:
-            set_service_attributes(service, stage_dot_service)
+            add_test_inputs(
+                service=service,
+                empty=stage_dot_service.split('.')[0] == 'data'
+            )
         except Exception as err:
             logging.error(
-                PFX + "Failed to set attributes for "
-                f"{stage_dot_service} with msg:\n {err}"
+                "%sFailed to assign test inputs for %s with msg:\n %s",
+                PFX, stage_dot_service, err
             )
-            stage_dot_services_failed.append(stage_dot_service)
-            continue
+            return stage_dot_service, "fail", err
 
+    #if service.data is not None: # we should never be in this state here
+    if service.calc_mode is None:
+        logging.debug("%sSetting calc_mode ...", PFX)
         try:
-            logging.debug(PFX + "Setting up and running service...")
-            run_service_test(service)
-            logging.info(PFX + f"{stage_dot_service} passed the test.")
-            nsuccesses += 1
+            service.calc_mode = 'events'
+        except ValueError:
+            service.calc_mode = TEST_BINNING
+        except ImportError as err:
+            if is_allowed_import_error(err, stage_dot_service, allow_missing):
+                return stage_dot_service, "ignore", err
         except Exception as err:
+            logging.error(
+                "%sFailed to set `calc_mode` for %s with msg:\n %s",
+                PFX, stage_dot_service, err
+            )
+            return stage_dot_service, "fail", err
+
+    if service.apply_mode is None:
+        logging.debug("%sSetting apply_mode ...", PFX)
+        try:
+            service.apply_mode = 'events'
+        except ValueError:
+            service.apply_mode = TEST_BINNING
+        except ImportError as err:
             if is_allowed_import_error(err, stage_dot_service, allow_missing):
-                stage_dot_services_failed_ignored.append(stage_dot_service)
-                continue
+                return stage_dot_service, "ignore", err
+        except Exception as err:
             logging.error(
-                PFX + f"{stage_dot_service} failed to setup or run "
-                f"with msg:\n {err}."
+                "%sFailed to set `apply_mode` for %s with msg:\n %s",
+                PFX, stage_dot_service, err
             )
-            stage_dot_services_failed.append(stage_dot_service)
+            return stage_dot_service, "fail", err
+
+    try:
+        set_service_attributes(service, stage_dot_service)
+    except Exception as err:
+        logging.error(
+            "%sFailed to set attributes for %s with msg:\n %s",
+            PFX, stage_dot_service, err
+        )
+        return stage_dot_service, "fail", err
+
+    try:
+        logging.debug("%sSetting up and running service...", PFX)
+        run_service_test(service)
+        logging.info("%s%s passed the test.", PFX, stage_dot_service)
+    except Exception as err:
+        if is_allowed_import_error(err, stage_dot_service, allow_missing):
+            return stage_dot_service, "ignore", err
+        logging.error(
+            "%s%s failed to setup or run with msg:\n %s.",
+            PFX, stage_dot_service, err
+        )
+        return stage_dot_service, "fail", err
+
+    return stage_dot_service, "pass", None
+
+
+def _check_service_in_worker(*args, **kwargs):
+    """`check_service` for use in a worker process: the exception is
+    returned as its `repr`, since not every exception can be unpickled"""
+    stage_dot_service, status, err = check_service(*args, **kwargs)
+    return stage_dot_service, status, None if err is None else repr(err)
+
+
+def iter_service_tests(
+    path=STAGES_PATH,
+    init_test_name=INIT_TEST_NAME,
+    skip_services=SKIP_SERVICES,
+    allow_missing=OPTIONAL_MODULES,
+    verbosity=Levels.WARN,
+    nprocs=1,
+):
+    """Test the services found at `path` one by one (see `check_service`),
+    yielding `(stage_dot_service, status, err)` as soon as each test is done.
+    Services are tested serially if `nprocs` is 1, otherwise distributed
+    across `nprocs` worker processes (one per core if `nprocs` is 0 or None),
+    in which case `err` is the `repr` of the exception rather than the
+    exception."""
+    if nprocs == 0:
+        nprocs = None
+
+    # Service modules were (possibly) created after the interpreter started;
+    # invalidate finder caches once here rather than per import
+    invalidate_caches()
+
+    check = partial(
+        check_service if nprocs == 1 else _check_service_in_worker,
+        init_test_name=init_test_name,
+        skip_services=skip_services,
+        allow_missing=allow_missing,
+        verbosity=verbosity,
+    )
+    if nprocs == 1:
+        # Services are tested on the calling thread; `iter_services` submits
+        # all file scans to its thread pool up front, so discovering the next
+        # services still overlaps with testing the current one
+        for rel_file_path, service_names in iter_services(path=path):
+            if service_names:
+                yield check(rel_file_path, service_names)
+        return
+
+    # Finish discovery (and thereby shut down its thread pool) before forking
+    # the worker processes
+    services = [
+        (rel_file_path, service_names)
+        for rel_file_path, service_names in iter_services(path=path)
+        if service_names
+    ]
+    pending = deque()
+    with ProcessPoolExecutor(
+        max_workers=nprocs, initializer=set_verbosity, initargs=(verbosity,)
+    ) as executor:
+        try:
+            for rel_file_path, service_names in services:
+                pending.append(
+                    executor.submit(check, rel_file_path, service_names)
+                )
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # If the consumer stops early, don't wait for the queued tests on
+            # shutdown (`shutdown(cancel_futures=True)` requires Python 3.9)
+            for future in pending:
+                future.cancel()
+
+
+def test_services(
+    path=STAGES_PATH,
+    init_test_name=INIT_TEST_NAME,
+    skip_services=SKIP_SERVICES,
+    allow_missing=OPTIONAL_MODULES,
+    verbosity=Levels.WARN,
+    nprocs=1,
+):
+    """Modelled after `run_unit_tests.run_unit_tests`. See
+    `iter_service_tests` for the meaning of `nprocs`, and also
+    `test_all_services.py` for running the services via pytest-xdist."""
+    ntries = 0
+    nsuccesses = 0
+    stage_dot_services_failed_ignored = []
+    stage_dot_services_failed = []
+    set_verbosity(verbosity)
+
+    for stage_dot_service, status, _ in iter_service_tests(
+        path=path,
+        init_test_name=init_test_name,
+        skip_services=skip_services,
+        allow_missing=allow_missing,
+        verbosity=verbosity,
+        nprocs=nprocs,
+    ):
+        if status == "skip":
             continue
 
+        ntries += 1
+        if status == "pass":
+            nsuccesses += 1
+        elif status == "ignore":
+            stage_dot_services_failed_ignored.append(stage_dot_service)
+        else:
+            stage_dot_services_failed.append(stage_dot_service)
+
     logging.info(
-        PFX + f"{nsuccesses} out of {ntries} tested services passed the test."
+        "%s%d out of %d tested services passed the test.",
+        PFX, nsuccesses, ntries
     )
     nfail = ntries - nsuccesses
     nfail_ignored = len(stage_dot_services_failed_ignored)
     logging.info(
-        PFX + f"{nfail_ignored} out of {nfail} failures have been ignored."
+        "%s%d out of %d failures have been ignored.", PFX, nfail_ignored, nfail
     )
     nfail_remain = nfail - nfail_ignored
     if nfail_remain > 0:
@@ -398,6 +661,127 @@ def test_services(
         )
 
 
+def test_find_services_cache():
+    """Check that `find_services` reuses, invalidates, prunes and recovers
+    its on-disk cache"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        stages_path = join(tmpdir, "stages")
+        sub_path = join(stages_path, "sub")
+        os.makedirs(sub_path)
+        service_path = join(stages_path, "dummy.py")
+        helper_path = join(stages_path, "helper.py")
+        with open(service_path, "w") as f:
+            f.write("class dummy(Stage):\n    pass\n")
+        with open(helper_path, "w") as f:
+            f.write("def helper():\n    pass\n")
+        with open(join(sub_path, "other.py"), "w") as f:
+            f.write("class other(Stage):\n    pass\n")
+        cache_path = join(tmpdir, "cache", "services.json")
+
+        def found(path=stages_path):
+            services = find_services(path, cache_path=cache_path)
+            return {basename(k): v for k, v in services.items()}
+
+        def load_cache():
+            with open(cache_path, "r") as f:
+                return json.load(f)
+
+        def dump_cache(cache):
+            with open(cache_path, "w") as f:
+                json.dump(cache, f)
+
+        assert found() == {
+            "dummy.py": ["dummy"], "helper.py": [], "other.py": ["other"]
+        }
+        assert isfile(cache_path)
+
+        # Cache hit: unchanged files are not scanned again
+        cache = load_cache()
+        for entry in cache["files"].values():
+            entry[2] = ["cached"]
+        dump_cache(cache)
+        assert found()["dummy.py"] == ["cached"]
+
+        # Invalidation by size (with the mtime preserved)
+        stat = os.stat(service_path)
+        with open(service_path, "w") as f:
+            f.write("class renamed(Stage):\n    pass\n")
+        os.utime(service_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert found()["dummy.py"] == ["renamed"]
+
+        # Invalidation by mtime (with the size preserved)
+        with open(service_path, "w") as f:
+            f.write("class rename2(Stage):\n    pass\n")
+        os.utime(service_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert found()["dummy.py"] == ["rename2"]
+
+        # Entries of files outside the scanned path are kept...
+        assert found(sub_path) == {"other.py": ["cached"]}
+        assert len(load_cache()["files"]) == 3
+
+        # ...while those of deleted files are dropped
+        os.remove(helper_path)
+        assert "helper.py" not in found()
+        assert len(load_cache()["files"]) == 2
+
+        # Invalidation by scanner version
+        cache = load_cache()
+        cache["version"] = "outdated"
+        dump_cache(cache)
+        assert found() == {"dummy.py": ["rename2"], "other.py": ["other"]}
+
+        # Recovery from corrupt or unexpected contents
+        for contents in (
+            "not json",
+            "[1, 2]",
+            json.dumps({"version": SERVICES_CACHE_VERSION, "files": [1]}),
+            json.dumps(
+                {"version": SERVICES_CACHE_VERSION,
+                 "files": {filepath: 1 for filepath in cache["files"]}}
+            ),
+        ):
+            with open(cache_path, "w") as f:
+                f.write(contents)
+            assert found() == {"dummy.py": ["rename2"], "other.py": ["other"]}
+
+
+def test_scan_source_file_mmap():
+    """Check that scanning a source file via `mmap` finds the same services
+    as scanning the bytes read from it"""
+    global _MMAP_MIN_SIZE  # pylint: disable=global-statement
+    sources = {
+        "service.py": (
+            b"import numpy as np\n\n"
+            b"class helper(object):\n    pass\n\n"
+            b"class dummy(Stage):\n    pass\n\n"
+            b"    class indented( Stage ):\n        pass\n"
+        ),
+        "helper.py": b"def helper():\n    return 1\n",
+    }
+    min_size = _MMAP_MIN_SIZE
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            _MMAP_MIN_SIZE = 1
+            for filename, source in sources.items():
+                filepath = join(tmpdir, filename)
+                with open(filepath, "wb") as f:
+                    f.write(source)
+                assert _scan_source_file(filepath) == _scan_source_bytes(source)
+        finally:
+            _MMAP_MIN_SIZE = min_size
+    assert _scan_source_bytes(sources["service.py"]) == ["dummy", "indented"]
+    assert _scan_source_bytes(sources["helper.py"]) == []
+
+
+def _nprocs_arg(value):
+    """`argparse` type for `--nprocs`: a non-negative int, with 0 converted to
+    None (i.e., one worker process per core)"""
+    nprocs = int(value)
+    if nprocs < 0:
+        raise ArgumentTypeError(f"must not be negative, got {nprocs}")
+    return nprocs or None
+
+
 def parse_args(description=__doc__):
     """Parse command line arguments"""
     parser = ArgumentParser(description=description,
@@ -405,6 +789,11 @@ def parse_args(description=__doc__):
     parser.add_argument(
         "-v", action="count", default=Levels.WARN, help="set verbosity level"
     )
+    parser.add_argument(
+        "--nprocs", type=_nprocs_arg, default=1,
+        help="number of worker processes to test services in parallel"
+             " (0: one per core)"
+    )
     args = parser.parse_args()
     return args
 
@@ -415,7 +804,7 @@ def main():
     kwargs = vars(args)
     kwargs["verbosity"] = kwargs.pop("v")
     test_services(**kwargs)
-    logging.info(PFX + 'Services testing done.')
+    logging.info('%sServices testing done.', PFX)
 
 
 if __name__ == "__main__":
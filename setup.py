@@ -121,6 +121,7 @@ EXTRAS_REQUIRE = {
         'sphinx_rtd_theme',
         'versioneer',
         'pytest',
+        'pytest-xdist',
     ],
     # TODO: get mceq install to work... this is non-trivial since that
     # project isn't exactly cleanly instllable via pip already, plus it